@@ -9,6 +9,7 @@ setup(
     author='Lance Shelton',
     author_email='notarealemailaddress@notarealdomain.com',
     packages=['watt', 'watt.banks'],
+    package_data={'watt': ['interval_map.json']},
     scripts=[],
     url='https://github.com/lanceshelton/Watt/',
     license='LICENSE.txt',
@@ -4,6 +4,9 @@ watt programming API
 This file includes everything needed to write programs for watt.
 """
 
+import json
+import os
+
 class WattProgram(object):
     """
     Base class program
@@ -16,6 +19,71 @@ class WattProgram(object):
     measures = None
     commands = {}
 
+class WattCommand(object):
+    """
+    A command for the pedal.  Fields that are not set are None.
+
+    Programs may yield WattCommands or dicts in the same format
+    ({'bar': 0, 'beat': 0, 'effect': Effect.upOctave, 'toe': P5}), dicts are
+    converted with as_command.  time is the timestamp the command is scheduled
+    for (None plays immediately), force writes the command out even if the
+    device is already in that state.  sent is when a remote client sent the
+    command, for measuring latency.  interval is the toe when it is an
+    interval name rather than a toe value, it is worked out once here instead
+    of each time the command is written.
+    """
+    __slots__ = ('bar', 'beat', 'effect', 'toe', 'interval', 'stomp', 'time',
+                 'force', 'sent')
+
+    def __init__(self, effect=None, toe=None, stomp=None, bar=None,
+                 beat=None, time=None, force=False, sent=None):
+        self.effect = effect
+        self.toe = toe
+        self.interval = toe if type(toe) is str else None
+        self.stomp = stomp
+        self.bar = bar
+        self.beat = beat
+        self.time = time
+        self.force = force
+        self.sent = sent
+
+    def __repr__(self):
+        return 'WattCommand(%s)' % ', '.join(
+            '%s=%r' % (name, getattr(self, name)) for name in self.__slots__
+            if name != 'interval' and getattr(self, name) is not None)
+
+def as_command(command):
+    """Convert a command to a WattCommand.  Also accepts the dict formats used
+    by programs ({'bar': 0, 'beat': 0, 'toe': P5, ...}) and for scheduled
+    commands ({'cmd': {...}, 'time': 100, 'force': True}).
+    """
+    if type(command) is WattCommand:
+        return command
+    if 'cmd' in command:
+        cmd = as_command(command['cmd'])
+        return WattCommand(cmd.effect, cmd.toe, cmd.stomp, cmd.bar, cmd.beat,
+                           command.get('time'),
+                           bool(command.get('force')) or cmd.force)
+    return WattCommand(command.get('effect'), command.get('toe'),
+                       command.get('stomp'), command.get('bar'),
+                       command.get('beat'), command.get('time'),
+                       bool(command.get('force')))
+
+def compile_program(prog):
+    """Convert the commands of a program to WattCommands
+    """
+    return [as_command(command) for command in prog.commands]
+
+# supported tempo range, beats are too short to schedule above MAX_BPM
+MIN_BPM = 10
+MAX_BPM = 1000
+
+def beat_to_ts(bpm, beats, measure, beat):
+    """Convert a music time notation to a timestamp
+    """
+    ms_per_beat = 60 * 1000 / bpm
+    return int((beats * measure + beat) * ms_per_beat)
+
 class Effect(object):
     """ Type of effect generated by the pedal """
     shallowDetune = 0
@@ -113,6 +181,10 @@ D_MIN21 = 'Dm21'
 D_MAJ21 = 'DM21'
 D_P22 = 'DP22'
 
+# pitch classes of the natural notes, for naming keys
+NATURAL_PITCH_CLASSES = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9,
+                         'B': 11}
+
 # scales
 CHROMATIC = [D_P22, D_MAJ21, D_MIN21, D_MAJ20, D_MIN20, D_P19, D_AUG18, D_P18,
              D_MAJ17, D_MIN17, D_MAJ16, D_MIN16,
@@ -141,6 +213,77 @@ MODES = [IONIAN,
 WHOLETONE = [P1, MAJ2, MAJ3, AUG4, MIN6, MIN6, P8]
 PENTATONIC = [P1, MIN3, P4, P5, MIN7, P8]
 
+def interval_semitones(interval):
+    """Number of semitones an interval shifts the input pitch (negative for
+    down)
+    """
+    return CHROMATIC.index(interval) - CHROMATIC.index(P1)
+
+def semitone_interval(semitones):
+    """The interval that shifts the input pitch by a number of semitones, or
+    None if it is out of range
+    """
+    idx = CHROMATIC.index(P1) + semitones
+    if idx >= 0 and idx < len(CHROMATIC):
+        return CHROMATIC[idx]
+    return None
+
+def key_pitch_class(key):
+    """Pitch class (0 for C to 11 for B) of a key name such as 'C', 'f#' or
+    'Bb'.  Raises ValueError for an unknown key.
+    """
+    name = key.strip()
+    if not name or name[0].upper() not in NATURAL_PITCH_CLASSES or \
+            name[1:].lower() not in ('', '#', 'b'):
+        raise ValueError('unknown key: %s' % key)
+    offset = {'': 0, '#': 1, 'b': -1}[name[1:].lower()]
+    return (NATURAL_PITCH_CLASSES[name[0].upper()] + offset) % 12
+
+def plays_interval(effect, interval):
+    """True if an effect can play an interval within MAX_CENT_ERROR cents.
+    Hand tuned tables have no measured error and are trusted.
+    """
+    return interval in INTERVAL_MAP.get(effect, {}) and \
+        abs(INTERVAL_ERROR[effect].get(interval, 0)) <= MAX_CENT_ERROR
+
+def interval_effect(interval, current=None):
+    """Choose an effect that plays an interval.  To avoid patch switches the
+    current effect is kept if it can play the interval, then the first of
+    DEFAULT_EFFECTS that can is used.  Otherwise the effect with the lowest
+    measured cent error in its calibrated table (see calibrate.py) is used.
+    Returns None if no effect can play it.
+    """
+    for effect in [current] + DEFAULT_EFFECTS:
+        if plays_interval(effect, interval):
+            return effect
+    measured = [(abs(errors[interval]), effect)
+                for effect, errors in INTERVAL_ERROR.items()
+                if interval in errors and plays_interval(effect, interval)]
+    if measured:
+        return min(measured)[1]
+    return None
+
+def interval_command(interval, current=None):
+    """Build a command that plays an interval from the input pitch, choosing
+    an effect that can generate it.  current is the effect the device is set
+    to, it is kept whenever it can play the interval.
+    """
+    cmd = WattCommand(toe=interval)
+    # P1 is accurately played in any of these patches.  By not reassigning the
+    # patch for P1, both ascending and descending scales can be completed
+    # without a patch switch.
+    if interval != P1:
+        effect = interval_effect(interval, current)
+        if effect is not None and effect != current:
+            cmd.effect = effect
+    return cmd
+
+# Effects used for intervals the current effect cannot play, in order of
+# preference
+DEFAULT_EFFECTS = [Effect.up2Octaves, Effect.down2Octaves, Effect.diveBomb]
+# intervals are only played by an effect that plays them this accurately
+MAX_CENT_ERROR = 25
+
 # A map of the intervals that can be generated with each effect to the toe
 # values that generates them
 INTERVAL_MAP = {
@@ -201,3 +344,23 @@ INTERVAL_MAP = {
     Effect.up2ndUp3rd: {
     },
 }
+
+# Interval tables measured with calibrate.py.  Measured toe values replace the
+# hand tuned ones above, and the measured error of each is kept in cents.
+INTERVAL_MAP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 'interval_map.json')
+INTERVAL_ERROR = dict((effect, {}) for effect in Effect.effect_range)
+
+def load_interval_map(path=INTERVAL_MAP_FILE):
+    """Load calibrated interval tables into INTERVAL_MAP
+    """
+    with open(path) as fin:
+        data = json.load(fin)
+    for name, table in data['effects'].items():
+        effect = getattr(Effect, str(name))
+        for interval, entry in table['intervals'].items():
+            INTERVAL_MAP[effect][str(interval)] = entry['toe']
+            INTERVAL_ERROR[effect][str(interval)] = entry['cents']
+
+if os.path.exists(INTERVAL_MAP_FILE):
+    load_interval_map()
@@ -0,0 +1,468 @@
+"""
+watt audio input
+
+Track the pitch and onsets of an audio input and turn them into watt commands.
+
+Audio is read in small frames from a source (a WAV file, or a synthesized tone
+standing in for a sound device), analyzed with YIN pitch detection and spectral
+flux onset detection, and the detections are mapped to commands by a control:
+
+- OnsetStepper plays the next step of a program on each onset
+- Harmonizer chooses an interval from the detected input note to play a
+  diatonic harmony in a key
+
+Testing from the command line (reports latency and CPU use):
+python ./audio.py input.wav
+
+Requires numpy.
+"""
+
+from collections import namedtuple
+import math
+import os
+import sys
+import time
+import wave
+import numpy
+from api import *  # pylint: disable=unused-wildcard-import,wildcard-import
+
+SAMPLE_RATE = 48000
+HOP_SIZE = 256
+WINDOW_SIZE = 2048
+
+# pitch detection
+MIN_FREQ = 50.0
+MAX_FREQ = 2000.0
+YIN_THRESHOLD = 0.15
+# windows quieter than this (RMS) are treated as silence
+SILENCE_RMS = 0.005
+
+# onset detection
+ONSET_RATIO = 1.5
+ONSET_FLOOR = 0.02
+ONSET_SMOOTHING = 0.9
+ONSET_MIN_GAP_SECS = 0.05
+
+# the harmonizer plays a note once it has been detected this many frames in a
+# row, so the transition between notes is not harmonized
+HOLD_FRAMES = 4
+
+# YIN needs at least two periods of the lowest frequency in a window
+assert WINDOW_SIZE >= 2 * SAMPLE_RATE / MIN_FREQ
+
+Detection = namedtuple('Detection', 'time freq note confidence onset')
+
+def freq_to_note(freq):
+    """Convert a frequency to a (fractional) MIDI note number
+    """
+    return 69 + 12 * math.log(freq / 440.0, 2)
+
+#
+# Sources
+#
+
+def wav_samples(wav, count):
+    """Read up to count frames from an open WAV file as mono floats in
+    [-1, 1)
+    """
+    channels = wav.getnchannels()
+    width = wav.getsampwidth()
+    if width == 1:
+        dtype, offset, scale = numpy.uint8, 128.0, 128.0
+    elif width == 2:
+        dtype, offset, scale = numpy.int16, 0.0, 32768.0
+    elif width == 4:
+        dtype, offset, scale = numpy.int32, 0.0, 2147483648.0
+    else:
+        raise ValueError('unsupported sample width: %d' % width)
+    samples = numpy.frombuffer(wav.readframes(count), dtype=dtype)
+    samples = samples[:len(samples) - len(samples) % channels]
+    return ((samples.reshape(-1, channels).mean(axis=1) - offset) /
+            scale).astype(numpy.float32)
+
+def read_wav(path):
+    """Read a whole WAV file, returns (samples, sample_rate)
+    """
+    wav = wave.open(path, 'rb')
+    try:
+        return wav_samples(wav, wav.getnframes()), wav.getframerate()
+    finally:
+        wav.close()
+
+class WavSource(object):
+    """Read mono frames from a WAV file.  In realtime mode frames are delivered
+    at the rate a sound device would deliver them.
+    """
+
+    def __init__(self, path, hop_size=HOP_SIZE, realtime=False):
+        self.path = path
+        self.hop_size = hop_size
+        self.realtime = realtime
+        wav = wave.open(path, 'rb')
+        self.sample_rate = wav.getframerate()
+        wav.close()
+
+    def __iter__(self):
+        wav = wave.open(self.path, 'rb')
+        start = time.time()
+        count = 0
+        try:
+            while True:
+                frame = wav_samples(wav, self.hop_size)
+                if len(frame) < self.hop_size:
+                    break
+                count += 1
+                if self.realtime:
+                    delay = (start + float(count * self.hop_size) /
+                             self.sample_rate - time.time())
+                    if delay > 0:
+                        time.sleep(delay)
+                yield frame
+        finally:
+            wav.close()
+
+class ToneSource(object):
+    """Synthesize a sequence of tones, standing in for a sound device.  Each
+    note is a (frequency, seconds) pair, a frequency of None is silence.
+    """
+
+    def __init__(self, notes, sample_rate=SAMPLE_RATE, hop_size=HOP_SIZE,
+                 realtime=False):
+        self.notes = notes
+        self.sample_rate = sample_rate
+        self.hop_size = hop_size
+        self.realtime = realtime
+
+    def __iter__(self):
+        parts = []
+        for freq, secs in self.notes:
+            samples = numpy.arange(int(secs * self.sample_rate))
+            if freq is None:
+                parts.append(numpy.zeros(len(samples)))
+                continue
+            # decaying plucked tone so that repeated notes have onsets
+            envelope = 0.5 * numpy.exp(-3.0 * samples / self.sample_rate)
+            parts.append(envelope * numpy.sin(2 * numpy.pi * freq * samples /
+                                              self.sample_rate))
+        signal = numpy.concatenate(parts).astype(numpy.float32)
+        start = time.time()
+        for count, pos in enumerate(range(0, len(signal) - self.hop_size + 1,
+                                          self.hop_size)):
+            if self.realtime:
+                delay = (start + float(count * self.hop_size) /
+                         self.sample_rate - time.time())
+                if delay > 0:
+                    time.sleep(delay)
+            yield signal[pos:pos + self.hop_size]
+
+#
+# Analysis
+#
+
+class PitchTracker(object):
+    """Streaming pitch and onset detection over overlapping windows.  Every
+    hop of input completes one window, all windows completed by a block of
+    input are analyzed together.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, hop_size=HOP_SIZE,
+                 window_size=WINDOW_SIZE):
+        self.sample_rate = sample_rate
+        self.hop_size = hop_size
+        self.window_size = window_size
+        # YIN integrates over half the window and searches lags up to half
+        self.integration = window_size // 2
+        self.min_lag = max(2, int(sample_rate / MAX_FREQ))
+        self.max_lag = min(self.integration - 2, int(sample_rate / MIN_FREQ))
+        self.fft_size = 1
+        while self.fft_size < window_size + self.integration:
+            self.fft_size *= 2
+        self.hann = numpy.hanning(window_size).astype(numpy.float32)
+        self.history = numpy.zeros(window_size - hop_size, dtype=numpy.float32)
+        self.pending = numpy.zeros(0, dtype=numpy.float32)
+        self.prev_spectrum = None
+        self.flux_avg = 0.0
+        self.last_onset = None
+        self.samples = 0
+
+    def windows(self, block):
+        """Split the input into overlapping windows, one per completed hop
+        """
+        self.pending = numpy.concatenate((self.pending, block))
+        hops = len(self.pending) // self.hop_size
+        if hops == 0:
+            return numpy.zeros((0, self.window_size), dtype=numpy.float32)
+        used = hops * self.hop_size
+        data = numpy.concatenate((self.history, self.pending[:used]))
+        self.pending = self.pending[used:]
+        self.history = data[len(data) - len(self.history):]
+        starts = numpy.arange(hops) * self.hop_size
+        return data[starts[:, None] + numpy.arange(self.window_size)]
+
+    def pitch(self, frames):
+        """YIN pitch detection for each row of frames.  Returns arrays of
+        frequencies (0 when unvoiced) and confidences.
+        """
+        width = self.integration
+        # autocorrelation of the first half of each window against all lags
+        spectrum = numpy.fft.rfft(frames, self.fft_size)
+        head = numpy.fft.rfft(frames[:, :width], self.fft_size)
+        acf = numpy.fft.irfft(numpy.conj(head) * spectrum,
+                              self.fft_size)[:, :width]
+        # energy of the window at each lag
+        energy = numpy.cumsum(numpy.concatenate(
+            (numpy.zeros((len(frames), 1)), frames ** 2), axis=1), axis=1)
+        lag_energy = energy[:, width:2 * width] - energy[:, :width]
+        diff = energy[:, width:width + 1] + lag_energy - 2 * acf
+        # cumulative mean normalized difference
+        lags = numpy.arange(width)
+        running = numpy.cumsum(diff[:, 1:], axis=1)
+        cmnd = numpy.ones_like(diff)
+        cmnd[:, 1:] = diff[:, 1:] * lags[1:] / numpy.maximum(running, 1e-12)
+
+        search = cmnd[:, self.min_lag:self.max_lag + 1]
+        below = search < YIN_THRESHOLD
+        voiced = below.any(axis=1)
+        first = numpy.where(voiced, below.argmax(axis=1),
+                            search.argmin(axis=1))
+        # walk down from the first lag below threshold to the local minimum
+        rising = numpy.zeros_like(below)
+        rising[:, :-1] = search[:, 1:] > search[:, :-1]
+        rising[:, -1] = True
+        rising &= numpy.arange(search.shape[1]) >= first[:, None]
+        best = rising.argmax(axis=1)
+
+        # parabolic interpolation around the minimum
+        rows = numpy.arange(len(frames))
+        lag = best + self.min_lag
+        left = cmnd[rows, numpy.maximum(lag - 1, 0)]
+        center = cmnd[rows, lag]
+        right = cmnd[rows, numpy.minimum(lag + 1, width - 1)]
+        denom = left - 2 * center + right
+        shift = numpy.where(numpy.abs(denom) > 1e-12,
+                            0.5 * (left - right) /
+                            numpy.where(denom == 0, 1, denom), 0)
+        period = lag + numpy.clip(shift, -1, 1)
+
+        rms = numpy.sqrt(energy[:, -1] / self.window_size)
+        voiced &= rms > SILENCE_RMS
+        freqs = numpy.where(voiced, self.sample_rate / period, 0.0)
+        confidence = numpy.where(voiced, 1 - numpy.clip(center, 0, 1), 0.0)
+        return freqs, confidence
+
+    def flux(self, frames):
+        """Spectral flux of each windowed frame against the previous one
+        """
+        mags = numpy.log1p(100 * numpy.abs(numpy.fft.rfft(frames * self.hann)))
+        if self.prev_spectrum is None:
+            self.prev_spectrum = mags[0]
+        prev = numpy.vstack((self.prev_spectrum[None, :], mags[:-1]))
+        self.prev_spectrum = mags[-1]
+        return numpy.maximum(mags - prev, 0).mean(axis=1)
+
+    def process(self, block):
+        """Analyze a block of samples, returning a Detection for each window
+        completed by the block
+        """
+        frames = self.windows(numpy.asarray(block, dtype=numpy.float32))
+        if len(frames) == 0:
+            return []
+        freqs, confidence = self.pitch(frames.astype(numpy.float64))
+        flux = self.flux(frames)
+        detections = []
+        for i in range(len(frames)):
+            self.samples += self.hop_size
+            now = float(self.samples) / self.sample_rate
+            # adaptive threshold: onsets stand out from the recent average
+            onset = (flux[i] > ONSET_RATIO * self.flux_avg + ONSET_FLOOR and
+                     (self.last_onset is None or
+                      now - self.last_onset > ONSET_MIN_GAP_SECS))
+            if onset:
+                self.last_onset = now
+            self.flux_avg = (ONSET_SMOOTHING * self.flux_avg +
+                             (1 - ONSET_SMOOTHING) * flux[i])
+            if freqs[i] > 0:
+                freq = float(freqs[i])
+                note = freq_to_note(freq)
+            else:
+                freq = note = None
+            detections.append(Detection(now, freq, note, float(confidence[i]),
+                                        onset))
+        return detections
+
+#
+# Controls
+#
+
+class OnsetStepper(object):
+    """Play a program one step at a time, advancing a step on each onset.  A
+    step is all the commands of a program at the same bar and beat.
+    """
+
+    def __init__(self, prog):
+        self.steps = []
+        for command in sorted(compile_program(prog),
+                              key=lambda cmd: (cmd.bar, cmd.beat)):
+            pos = (command.bar, command.beat)
+            if not self.steps or self.steps[-1][0] != pos:
+                self.steps.append((pos, []))
+            self.steps[-1][1].append(command)
+        self.step = 0
+
+    def commands(self, detection):
+        """Commands triggered by a detection
+        """
+        if not detection.onset or not self.steps:
+            return []
+        step = self.steps[self.step][1]
+        self.step = (self.step + 1) % len(self.steps)
+        return step
+
+class Harmonizer(object):
+    """Play a diatonic harmony of the input note.  degrees is the number of
+    scale steps from the input note to the harmony (2 is a third above, -2 a
+    third below).  key is a key name such as 'C', 'f#' or 'Bb'.
+    current_effect returns the effect the device is set to, so that it is kept
+    whenever it can play the harmony.
+
+    A note is harmonized once it has been detected with at least
+    min_confidence for hold_frames frames in a row, and only if it is not the
+    note already harmonized.
+    """
+
+    def __init__(self, key='C', scale=IONIAN, degrees=2, min_confidence=0.8,
+                 current_effect=None, hold_frames=HOLD_FRAMES):
+        self.root = key_pitch_class(key)
+        self.current_effect = current_effect or (lambda: None)
+        # scale steps in semitones, without the octave
+        self.steps = [interval_semitones(note) for note in scale][:-1]
+        self.degrees = degrees
+        self.min_confidence = min_confidence
+        self.hold_frames = hold_frames
+        # the note harmonized, and the note waiting to hold long enough
+        self.note = None
+        self.candidate = None
+        self.held = 0
+
+    def interval(self, note):
+        """The interval from an input MIDI note to its harmony
+        """
+        octave, pitch_class = divmod(note - self.root, 12)
+        # notes outside the scale harmonize from the nearest scale step below
+        degree = max(i for i, step in enumerate(self.steps)
+                     if step <= pitch_class)
+        octaves, target = divmod(degree + self.degrees, len(self.steps))
+        target_note = self.root + 12 * (octave + octaves) + self.steps[target]
+        return semitone_interval(target_note - note)
+
+    def commands(self, detection):
+        """Commands triggered by a detection
+        """
+        voiced = (detection.note is not None and
+                  detection.confidence >= self.min_confidence)
+        if detection.onset or not voiced:
+            # after an onset the window still holds the previous note, wait
+            # for the new pitch to hold instead
+            self.candidate = None
+            self.held = 0
+        if not voiced:
+            return []
+        note = int(round(detection.note))
+        if note != self.candidate:
+            self.candidate = note
+            self.held = 0
+        self.held += 1
+        if self.held < self.hold_frames or note == self.note:
+            return []
+        self.note = note
+        interval = self.interval(note)
+        if interval is None:
+            return []
+        return [interval_command(interval, self.current_effect())]
+
+#
+# Pipeline
+#
+
+class PipelineStats(object):
+    """Processing time of an audio pipeline against its real time budget
+    """
+
+    def __init__(self, sample_rate, hop_size):
+        self.budget_ms = 1000.0 * hop_size / sample_rate
+        self.sample_rate = sample_rate
+        self.samples = 0
+        self.blocks = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.overruns = 0
+        self.cpu_secs = 0.0
+
+    def add_block(self, samples, elapsed_ms):
+        """Record the processing time of one block of samples
+        """
+        self.samples += samples
+        self.blocks += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        # a block must be processed in less time than it takes to play
+        if elapsed_ms > 1000.0 * samples / self.sample_rate:
+            self.overruns += 1
+
+    @property
+    def audio_secs(self):
+        """Seconds of audio processed"""
+        return float(self.samples) / self.sample_rate
+
+    def report(self):
+        """Summary of the latency and CPU use
+        """
+        if self.blocks == 0:
+            return 'no audio processed'
+        return ('%.1fs audio, frame budget %.2fms, latency mean %.3fms max '
+                '%.3fms, %d overruns, %.1fms CPU per second of audio' %
+                (self.audio_secs, self.budget_ms,
+                 self.total_ms / self.blocks, self.max_ms, self.overruns,
+                 1000.0 * self.cpu_secs / max(self.audio_secs, 1e-9)))
+
+def cpu_time():
+    """CPU time used by this process in seconds
+    """
+    times = os.times()
+    return times[0] + times[1]
+
+def run_pipeline(source, control, emit, stop_event=None, tracker=None):
+    """Read a source until it is exhausted or stop_event is set, passing the
+    commands generated by control to emit.  Returns PipelineStats.
+    """
+    if tracker is None:
+        tracker = PitchTracker(source.sample_rate, source.hop_size)
+    stats = PipelineStats(tracker.sample_rate, tracker.hop_size)
+    cpu_start = cpu_time()
+    for block in source:
+        if stop_event is not None and stop_event.is_set():
+            break
+        start = time.time()
+        for detection in tracker.process(block):
+            for cmd in control.commands(detection):
+                emit(cmd)
+        stats.add_block(len(block), 1000 * (time.time() - start))
+    stats.cpu_secs = cpu_time() - cpu_start
+    return stats
+
+def main(args):
+    """Analyze a WAV file (or a synthesized scale) as fast as possible and
+    report the detections and processing cost
+    """
+    if len(args) > 1:
+        source = WavSource(args[1])
+    else:
+        source = ToneSource([(261.63 * 2 ** (step / 12.0), 0.25)
+                             for step in (0, 2, 4, 5, 7, 9, 11, 12)] * 4)
+    emitted = []
+    stats = run_pipeline(source, Harmonizer(), emitted.append)
+    sys.stdout.write('%d commands\n%s\n' % (len(emitted), stats.report()))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
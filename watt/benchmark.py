@@ -0,0 +1,128 @@
+"""
+watt memory benchmark
+
+Hold an hour long arrangement of a program in memory, once as the dicts that
+were queued before WattCommand ({'cmd': {...}, 'time': ...}) and once as the
+program loops write_program queues (the compiled WattCommands shared by every
+loop, with the loop start time and event offsets), and compare the memory and
+garbage collector load per event.
+
+python ./benchmark.py -p siren
+"""
+
+from optparse import OptionParser
+import gc
+import sys
+import time
+from api import *  # pylint: disable=unused-wildcard-import,wildcard-import
+from banks import *  # pylint: disable=unused-wildcard-import,wildcard-import
+
+ARRANGEMENT_SECS = 60 * 60
+
+def legacy_arrangement(prog, secs):
+    """Schedule a program for secs seconds in the legacy dict format
+    """
+    events = []
+    start = 0
+    length = beat_to_ts(prog.bpm, prog.beats, prog.measures, 0)
+    while start < secs * 1000:
+        for command in prog.commands:
+            tstamp = beat_to_ts(prog.bpm, prog.beats, command['bar'],
+                                command['beat'])
+            events.append({'cmd': command, 'time': start + tstamp})
+        start += length
+    return events
+
+def compact_arrangement(prog, secs):
+    """Schedule a program for secs seconds as write_program does, one
+    (start_time, events, offsets) tuple per loop sharing the compiled events
+    """
+    loops = []
+    start = 0
+    length = beat_to_ts(prog.bpm, prog.beats, prog.measures, 0)
+    compiled = compile_program(prog)
+    while start < secs * 1000:
+        offsets = [beat_to_ts(prog.bpm, prog.beats, event.bar, event.beat)
+                   for event in compiled]
+        loops.append((start, compiled, offsets))
+        start += length
+    return loops
+
+def event_count(arrangement):
+    """Number of events in an arrangement of either format
+    """
+    return sum(len(item[1]) if type(item) is tuple else 1
+               for item in arrangement)
+
+def deep_size(obj):
+    """Total size in bytes of an object and everything it references
+    """
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        elif hasattr(obj, '__slots__'):
+            stack.extend(getattr(obj, name) for name in obj.__slots__)
+    return total
+
+def measure(arrangement, prog, secs):
+    """Build an arrangement, returns (events, bytes, objects tracked by the
+    garbage collector, seconds to build)
+    """
+    gc.collect()
+    start = time.time()
+    events = arrangement(prog, secs)
+    elapsed = time.time() - start
+    del events
+    # with collection disabled the generation 0 count is the number of
+    # container objects allocated and still alive
+    gc.collect()
+    gc.disable()
+    try:
+        tracked = gc.get_count()[0]
+        events = arrangement(prog, secs)
+        tracked = gc.get_count()[0] - tracked
+    finally:
+        gc.enable()
+    return event_count(events), deep_size(events), tracked, elapsed
+
+def main(args):
+    """Parse arguments, run the benchmark
+    """
+    parser = OptionParser(description=__doc__)
+    parser.add_option("-p", "--program", default='siren',
+                      help="program to arrange")
+    parser.add_option("-s", "--secs", default=str(ARRANGEMENT_SECS),
+                      help="length of the arrangement in seconds")
+
+    options = parser.parse_args(args)[0]
+
+    programs = {}
+    for cls in WattProgram.__subclasses__():  # pylint: disable=no-member
+        programs[cls.name] = cls
+    if options.program not in programs:
+        sys.stdout.write('Program %s not found in path\n' % options.program)
+        return -1
+
+    for name, arrangement in (('dict', legacy_arrangement),
+                              ('WattCommand', compact_arrangement)):
+        events, size, tracked, elapsed = measure(
+            arrangement, programs[options.program](), float(options.secs))
+        sys.stdout.write('%-12s %d events, %.1f MB (%.0f bytes/event), '
+                         '%.2f gc tracked objects/event, built in %.2fs\n' %
+                         (name, events, size / 1e6, float(size) / events,
+                          float(tracked) / events, elapsed))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
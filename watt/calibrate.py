@@ -0,0 +1,225 @@
+"""
+watt calibration
+
+Measure the interval generated by each effect at each toe value and build the
+interval to toe tables used by INTERVAL_MAP.
+
+Record a sine reference tone through the pedal once for every (effect, toe)
+pair, one WAV file per pair named <effect>-<toe>.wav, where effect is the name
+(or number) of the effect:
+
+recordings/up2ndUp3rd-0.wav
+recordings/up2ndUp3rd-1.wav
+...
+recordings/up2ndUp3rd-127.wav
+
+Then generate the tables (cached to interval_map.json, which api.py loads):
+python ./calibrate.py -d recordings -f 220
+
+Requires numpy.
+"""
+
+from multiprocessing import Pool, cpu_count
+from optparse import OptionParser
+import json
+import math
+import os
+import sys
+import numpy
+from api import *  # pylint: disable=unused-wildcard-import,wildcard-import
+from audio import read_wav
+
+# ignore the attack while the pedal settles on the new setting
+SETTLE_SECS = 0.1
+FFT_SIZE = 16384
+HOP_SIZE = FFT_SIZE // 4
+# recordings with no peak louder than this are silent (e.g. a mute)
+SILENCE_MAGNITUDE = 1e-3
+# effects that mix the dry signal in with the shifted voice
+MIXES_DRY = set([Effect.shallowDetune, Effect.deepDetune, Effect.up2ndUp3rd,
+                 Effect.upm3rdUp3rd, Effect.up3rdUp4th, Effect.up4thUp5th,
+                 Effect.up5thUp6th, Effect.up5thUp7th, Effect.down4thDown3rd,
+                 Effect.down5thDown4th, Effect.downOctaveUpOctave])
+# for those effects a shifted voice is accepted if it is this loud relative to
+# the strongest peak
+SHIFTED_PEAK_RATIO = 0.1
+# peaks this close to the reference tone are the dry signal (the reference is
+# a sine, so it has no harmonics)
+DRY_CENTS = 30
+
+EFFECTS = dict((name, value) for name, value in vars(Effect).items()
+               if isinstance(value, int))
+EFFECT_NAMES = dict((value, name) for name, value in EFFECTS.items())
+
+def parse_name(filename):
+    """Parse a recording file name into (effect, toe), or None if it is not a
+    recording
+    """
+    base, ext = os.path.splitext(filename)
+    if ext.lower() != '.wav' or '-' not in base:
+        return None
+    effect, toe = base.rsplit('-', 1)
+    if effect.isdigit():
+        effect = int(effect)
+    elif effect in EFFECTS:
+        effect = EFFECTS[effect]
+    else:
+        return None
+    if effect not in Effect.effect_range or not toe.isdigit() or \
+            int(toe) > 127:
+        return None
+    return effect, int(toe)
+
+def peak_freq(spectrum, idx, sample_rate):
+    """Interpolated frequency of the spectrum peak at bin idx
+    """
+    if idx <= 0 or idx >= len(spectrum) - 1:
+        return float(idx) * sample_rate / FFT_SIZE
+    left, center, right = numpy.log(spectrum[idx - 1:idx + 2] + 1e-12)
+    denom = left - 2 * center + right
+    shift = 0.5 * (left - right) / denom if denom != 0 else 0.0
+    return (idx + shift) * sample_rate / FFT_SIZE
+
+def measure(args):
+    """Measure the shift in cents from the reference frequency in a recording.
+    Returns (effect, toe, cents), cents is None when nothing was measured.
+    """
+    path, effect, toe, reference = args
+    samples, sample_rate = read_wav(path)
+    samples = samples[int(SETTLE_SECS * sample_rate):]
+    if len(samples) < FFT_SIZE:
+        return effect, toe, None
+    # average spectrum over all windows
+    starts = numpy.arange(0, len(samples) - FFT_SIZE + 1, HOP_SIZE)
+    frames = samples[starts[:, None] + numpy.arange(FFT_SIZE)]
+    spectrum = numpy.abs(numpy.fft.rfft(frames * numpy.hanning(FFT_SIZE),
+                                        axis=1)).mean(axis=0)
+    spectrum /= numpy.hanning(FFT_SIZE).sum() / 2
+    freqs = numpy.arange(len(spectrum)) * float(sample_rate) / FFT_SIZE
+    # local maxima within the range of the effects (3 octaves down, 2 up)
+    peaks = numpy.where((spectrum[1:-1] > spectrum[:-2]) &
+                        (spectrum[1:-1] >= spectrum[2:]) &
+                        (freqs[1:-1] > reference / 9) &
+                        (freqs[1:-1] < reference * 5))[0] + 1
+    if len(peaks) == 0 or spectrum[peaks].max() < SILENCE_MAGNITUDE:
+        return effect, toe, None
+    strongest = peaks[spectrum[peaks].argmax()]
+    if effect in MIXES_DRY:
+        # measure the strongest peak that is not the dry signal, nothing was
+        # measured if there is no shifted voice
+        cents = 1200 * numpy.log2(freqs[peaks] / reference)
+        shifted = peaks[numpy.abs(cents) > DRY_CENTS]
+        if len(shifted) == 0:
+            return effect, toe, None
+        best = shifted[spectrum[shifted].argmax()]
+        if spectrum[best] < SHIFTED_PEAK_RATIO * spectrum[strongest]:
+            return effect, toe, None
+        strongest = best
+    freq = peak_freq(spectrum, strongest, sample_rate)
+    return effect, toe, 1200 * math.log(freq / reference, 2)
+
+def measure_all(directory, reference, processes=None):
+    """Measure every recording in a directory in parallel.  Returns
+    {effect: {toe: cents}}
+    """
+    jobs = []
+    for filename in sorted(os.listdir(directory)):
+        parsed = parse_name(filename)
+        if parsed is not None:
+            jobs.append((os.path.join(directory, filename), parsed[0],
+                         parsed[1], reference))
+    pool = Pool(processes or cpu_count())
+    try:
+        results = pool.map(measure, jobs, chunksize=8)
+    finally:
+        pool.close()
+        pool.join()
+    measured = {}
+    for effect, toe, cents in results:
+        if cents is not None:
+            measured.setdefault(effect, {})[toe] = cents
+    return measured
+
+def build_table(toe_cents, max_error=MAX_CENT_ERROR):
+    """Choose the toe value that plays each interval most accurately.  Returns
+    {interval: (toe, cent error)}
+    """
+    toes = numpy.array(sorted(toe_cents))
+    cents = numpy.array([toe_cents[toe] for toe in toes])
+    table = {}
+    for interval in CHROMATIC:
+        # ties go to the lowest toe value
+        errors = cents - 100 * interval_semitones(interval)
+        best = numpy.abs(errors).argmin()
+        if abs(errors[best]) <= max_error:
+            table[interval] = (int(toes[best]), float(errors[best]))
+    return table
+
+def calibrate(directory, reference, path=INTERVAL_MAP_FILE, processes=None,
+              max_error=MAX_CENT_ERROR):
+    """Measure the recordings in a directory and merge the interval tables
+    into the data file at path, replacing the tables of the effects that were
+    measured.  Effects with no interval within max_error keep their saved
+    table.  Returns the new tables, nothing is written if there are none.
+    """
+    measured = measure_all(directory, reference, processes)
+    tables = {}
+    for effect, toe_cents in measured.items():
+        table = build_table(toe_cents, max_error)
+        if table:
+            tables[effect] = table
+    if not tables:
+        return tables
+    data = {'effects': {}}
+    if os.path.exists(path):
+        with open(path) as fin:
+            data = json.load(fin)
+    for effect, table in tables.items():
+        data['effects'][EFFECT_NAMES[effect]] = {
+            'reference': reference,
+            'intervals': dict(
+                (interval, {'toe': toe, 'cents': round(error, 2)})
+                for interval, (toe, error) in table.items()),
+        }
+    with open(path, 'w') as fout:
+        json.dump(data, fout, indent=1, sort_keys=True)
+    return tables
+
+def main(args):
+    """Parse arguments, run the calibration and report the tables
+    """
+    parser = OptionParser(description=__doc__)
+    parser.add_option("-d", "--directory", default='.',
+                      help="directory of recordings")
+    parser.add_option("-f", "--frequency", default='220',
+                      help="frequency of the reference tone in Hz")
+    parser.add_option("-j", "--jobs", default=None,
+                      help="number of processes (default: one per core)")
+    parser.add_option("-m", "--max-error", default=str(MAX_CENT_ERROR),
+                      help="largest error in cents to accept an interval")
+    parser.add_option("-o", "--output", default=INTERVAL_MAP_FILE,
+                      help="data file to write")
+
+    options = parser.parse_args(args)[0]
+
+    tables = calibrate(options.directory, float(options.frequency),
+                       options.output,
+                       int(options.jobs) if options.jobs else None,
+                       float(options.max_error))
+    if not tables:
+        sys.stdout.write('No intervals measured from the recordings in %s\n' %
+                         options.directory)
+        return -1
+    for effect in sorted(tables):
+        table = tables[effect]
+        intervals = sorted(table, key=interval_semitones)
+        worst = max([abs(error) for _, error in table.values()] or [0])
+        sys.stdout.write('%s: %d intervals, worst error %.1f cents\n  %s\n' %
+                         (EFFECT_NAMES[effect], len(table), worst,
+                          ' '.join('%s=%d' % (interval, table[interval][0])
+                                   for interval in intervals)))
+    sys.stdout.write('Wrote %s\n' % options.output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,200 @@
+"""
+watt control server load test
+
+Run a control server with the command thread and MIDI output, then send bursts
+of commands from many clients at once and measure:
+
+- latency from each command being sent to it playing on the MIDI output.
+  Commands scheduled ahead play at their timestamp plus the output latency,
+  late ones when they are written.
+- processing latency from each command being sent to it being written, and the
+  slack left before DELAY_MS runs out
+- the error of the server's estimate of the client clock
+
+By default the clients stamp messages with a clock that is far ahead of the
+server's, so the server has to estimate the offset with ClientClock.  With -s
+they stamp messages with the server clock and no estimate is made.
+
+python ./loadtest.py -c 8 -n 1000 -b 50
+"""
+
+from optparse import OptionParser
+from Queue import Queue
+import socket
+import sys
+import threading
+from time import sleep
+import pygame.midi
+from api import *  # pylint: disable=unused-wildcard-import,wildcard-import
+from server import ClientClock, ControlServer, time_ms
+from watt import WattOutput, command_thread
+
+# the clients' clock is this many ms ahead of the server clock
+CLIENT_CLOCK_OFFSET = 1000000
+
+class SharedClock(ClientClock):
+    """Clients that stamp messages with the server clock need no estimate
+    """
+
+    def update(self, client_ms, now):
+        pass
+
+    def to_server(self, client_ms):
+        return client_ms
+
+class LoadServer(ControlServer):
+    """Control server that records the true send time of each command.  The
+    clients run in this process and stamp messages with the server clock plus
+    client_offset, so the true send time is known.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.client_offset = kwargs.pop('client_offset', CLIENT_CLOCK_OFFSET)
+        ControlServer.__init__(self, *args, **kwargs)
+        if self.client_offset == 0:
+            self.clock_class = SharedClock
+        self.true_sent = None
+        self.estimate_errors = []
+
+    def handle(self, line, client, now):
+        self.true_sent = float(line.split(None, 2)[1]) - self.client_offset
+        ControlServer.handle(self, line, client, now)
+
+    def schedule(self, command, sent, now):
+        # schedule from the estimated send time, measure from the true one
+        self.estimate_errors.append(sent - self.true_sent)
+        command.sent = self.true_sent
+        command.time = self.play_time(sent, now)
+        self.cmd_q.put(command)
+
+class LatencyOutput(WattOutput):
+    """MIDI output that records the latency of remote commands, as (written,
+    played) ms after they were sent
+    """
+
+    def __init__(self, *args, **kwargs):
+        WattOutput.__init__(self, *args, **kwargs)
+        self.latencies = []
+
+    def write_cmd(self, command, timestamp=None):
+        if timestamp is None:
+            timestamp = command.time
+        WattOutput.write_cmd(self, command, timestamp)
+        if command.sent is not None:
+            written = pygame.midi.time()
+            played = written
+            if timestamp is not None:
+                played = max(written, timestamp + self.latency)
+            self.latencies.append((written - command.sent,
+                                   played - command.sent))
+
+def client_thread(address, count, burst, gap_secs, seed, offset):
+    """Send count toe commands in bursts of burst messages
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for i in range(count):
+            toe = (seed + i) % 128
+            sock.sendto(('/toe %d %d' % (pygame.midi.time() + offset, toe))
+                        .encode('ascii'), address)
+            if (i + 1) % burst == 0:
+                sleep(gap_secs)
+    finally:
+        sock.close()
+
+def percentile(values, fraction):
+    """Value at a fraction of the way through sorted values
+    """
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def summary(values):
+    """Mean, median, 99th percentile and maximum of values
+    """
+    values = sorted(values)
+    return 'mean %.2fms p50 %.2fms p99 %.2fms max %.2fms' % (
+        float(sum(values)) / len(values), percentile(values, 0.5),
+        percentile(values, 0.99), values[-1])
+
+def main(args):
+    """Parse arguments, run the load test and report latency
+    """
+    parser = OptionParser(description=__doc__)
+    parser.add_option("-b", "--burst", default='50',
+                      help="messages sent back to back by a client")
+    parser.add_option("-c", "--clients", default='8',
+                      help="number of concurrent clients")
+    parser.add_option("-g", "--gap", default='0.05',
+                      help="seconds between bursts")
+    parser.add_option("-n", "--count", default='1000',
+                      help="messages sent by each client")
+    parser.add_option("-p", "--port", default='0',
+                      help="port to listen on (default: any free port)")
+    parser.add_option("-s", "--shared-clock", action="store_true",
+                      help="clients stamp messages with the server clock")
+
+    options = parser.parse_args(args)[0]
+    clients = int(options.clients)
+    count = int(options.count)
+    offset = 0 if options.shared_clock else CLIENT_CLOCK_OFFSET
+
+    watt = LatencyOutput()
+    cmd_q = Queue()
+    stop_event = threading.Event()
+    server = LoadServer(cmd_q, Queue(), {}, port=int(options.port),
+                        clock=pygame.midi.time, latency=watt.latency,
+                        client_offset=offset)
+    threads = [threading.Thread(target=command_thread,
+                                args=(watt, cmd_q, stop_event)),
+               threading.Thread(target=server.serve, args=(stop_event,))]
+    for thread in threads:
+        thread.start()
+
+    senders = [threading.Thread(target=client_thread,
+                                args=(server.address, count,
+                                      int(options.burst), float(options.gap),
+                                      i * 16, offset))
+               for i in range(clients)]
+    start = time_ms()
+    try:
+        for sender in senders:
+            sender.start()
+        for sender in senders:
+            sender.join()
+        # let the server and command thread catch up
+        sleep(0.5)
+        while not cmd_q.empty():
+            sleep(0.1)
+    finally:
+        elapsed = time_ms() - start
+        stop_event.set()
+        # wake the command thread so it sees the stop event
+        cmd_q.put(WattCommand(effect=Effect.diveBomb, stomp=STOMP_ENABLE,
+                              toe=MUTE, time=watt.last_timestamp + 10))
+        for thread in threads:
+            thread.join()
+        server.close()
+        watt.stop()
+
+    sent = clients * count
+    sys.stdout.write('%d clients sent %d messages in %.2fs, %s\n' %
+                     (clients, sent, elapsed / 1000, server.report()))
+    if not watt.latencies:
+        sys.stdout.write('no commands received\n')
+        return -1
+    written = [latency[0] for latency in watt.latencies]
+    played = [latency[1] for latency in watt.latencies]
+    slack = sorted(server.delay - latency for latency in written)
+    late = len([latency for latency in played if latency > server.delay])
+    sys.stdout.write('%d written (%d lost, %d late)\n' %
+                     (len(played), sent - len(played), late))
+    sys.stdout.write('sent to played:  %s\n' % summary(played))
+    sys.stdout.write('sent to written: %s\n' % summary(written))
+    sys.stdout.write('slack against %dms delay: min %.2fms p1 %.2fms\n' %
+                     (server.delay, slack[0], percentile(slack, 0.01)))
+    if not options.shared_clock:
+        sys.stdout.write('client clock estimate error: %s\n' %
+                         summary(server.estimate_errors))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,227 @@
+"""
+watt network control
+
+A UDP server that lets other devices (a tablet, a foot controller bridge, a
+second laptop) control watt alongside the keyboard.  Any number of clients may
+send at once.
+
+Messages are OSC style text, one per line, several may share a datagram:
+
+<address> <client time in ms> <argument>
+
+/interval 1520.5 M3        play an interval (see api.CHROMATIC)
+/effect 1520.5 upOctave    set the effect (by name or number)
+/toe 1520.5 64             set the toe position (0-127)
+/stomp 1520.5 0            set the stomp switch (0 bypass, 127 enable)
+/tempo 1520.5 +            tempo up (+), down (-) or to a bpm (10-1000)
+/program 1520.5 arpeggio   switch program at the end of the current loop
+
+/tempo and /program are errors unless a program is playing (not stepped
+through by audio input).
+
+The client time is read from any clock the client likes, as long as every
+client on a host uses the same one.  The server learns the offset of each
+host's clock from its own, and schedules each command the same delay after it
+was sent, so network jitter does not become timing jitter.
+"""
+
+from collections import deque
+import errno
+import math
+import select
+import socket
+import time
+from api import *  # pylint: disable=unused-wildcard-import,wildcard-import
+
+HOST = '127.0.0.1'
+PORT = 9000
+# commands play this long after they are sent, to absorb network jitter
+DELAY_MS = 20
+# number of recent messages used to estimate a client's clock offset
+CLOCK_WINDOW = 64
+# how often the server checks for a stop request
+POLL_SECS = 0.1
+MAX_DATAGRAM = 65507
+# large enough to hold bursts from many clients between reads
+RECV_BUFFER_BYTES = 1 << 20
+
+def parse_address(address):
+    """Parse a host:port address, raises ValueError if it is not valid
+    """
+    host, sep, port = address.rpartition(':')
+    if not sep or not port.isdigit() or int(port) > 65535:
+        raise ValueError('invalid address: %s' % address)
+    return host, int(port)
+
+def time_ms():
+    """Milliseconds from the system clock
+    """
+    return time.time() * 1000
+
+class ClientClock(object):
+    """Map a client's timestamps to the server clock.  The smallest difference
+    between the receive time and the send time of recent messages is the
+    clock offset plus the shortest network delay.
+    """
+
+    def __init__(self, window=CLOCK_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.offset = None
+
+    def update(self, client_ms, now):
+        """Record a message sent at client_ms and received at now
+        """
+        self.samples.append(now - client_ms)
+        self.offset = min(self.samples)
+
+    def to_server(self, client_ms):
+        """Convert a client timestamp to the server clock
+        """
+        return client_ms + self.offset
+
+class ControlServer(object):
+    """Receive control messages and push them onto the command and program
+    queues.  Reading never waits on the command thread, the queues are
+    unbounded.  prog_q is None when no program is playing, then /tempo and
+    /program are errors.
+
+    clock is the server clock in ms, latency is the MIDI output latency that
+    scheduled timestamps are relative to.  current_effect returns the effect
+    the device is set to, /interval keeps it whenever it can play the
+    interval.
+    """
+
+    # maps each host's timestamps to the server clock
+    clock_class = ClientClock
+
+    def __init__(self, cmd_q, prog_q, programs, host=HOST, port=PORT,
+                 clock=time_ms, latency=0, delay=DELAY_MS,
+                 current_effect=None):
+        self.cmd_q = cmd_q
+        self.prog_q = prog_q
+        self.programs = programs
+        self.clock = clock
+        self.latency = latency
+        self.delay = delay
+        self.current_effect = current_effect or (lambda: None)
+        self.clocks = {}
+        self.received = 0
+        self.errors = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                 RECV_BUFFER_BYTES)
+            self.sock.bind((host, port))
+            self.sock.setblocking(0)
+        except socket.error:
+            self.sock.close()
+            raise
+
+    @property
+    def address(self):
+        """(host, port) the server is bound to"""
+        return self.sock.getsockname()
+
+    def close(self):
+        """Close the socket
+        """
+        self.sock.close()
+
+    def serve(self, stop_event):
+        """Handle messages until stop_event is set
+        """
+        while not stop_event.is_set():
+            readable = select.select([self.sock], [], [], POLL_SECS)[0]
+            if readable:
+                self.drain()
+
+    def drain(self):
+        """Handle every datagram waiting on the socket
+        """
+        while True:
+            try:
+                data, client = self.sock.recvfrom(MAX_DATAGRAM)
+            except socket.error as err:
+                if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            now = self.clock()
+            for line in data.splitlines():
+                self.received += 1
+                try:
+                    self.handle(str(line.decode('ascii')), client, now)
+                except (ValueError, IndexError, UnicodeError):
+                    self.errors += 1
+
+    def play_time(self, sent, now):
+        """Timestamp to play a command DELAY_MS after it was sent, or None to
+        play it immediately if that has already passed
+        """
+        if sent + self.delay > now:
+            return sent + self.delay - self.latency
+        return None
+
+    def schedule(self, command, sent, now):
+        """Schedule a command DELAY_MS after it was sent
+        """
+        command.sent = sent
+        command.time = self.play_time(sent, now)
+        self.cmd_q.put(command)
+
+    def handle(self, line, client, now):
+        """Handle one message from a client
+        """
+        address, client_ms, arg = line.split(None, 2)
+        arg = arg.strip()
+        client_ms = float(client_ms)
+        if math.isinf(client_ms) or math.isnan(client_ms):
+            raise ValueError('invalid time: %s' % client_ms)
+        # clocks are per host, a client may send from a new port every time
+        host = client[0]
+        if host not in self.clocks:
+            self.clocks[host] = self.clock_class()
+        clock = self.clocks[host]
+        clock.update(client_ms, now)
+        sent = clock.to_server(client_ms)
+
+        if address == '/interval':
+            if arg not in CHROMATIC:
+                raise ValueError('unknown interval: %s' % arg)
+            self.schedule(interval_command(arg, self.current_effect()),
+                          sent, now)
+        elif address == '/effect':
+            effect = int(arg) if arg.isdigit() else getattr(Effect, arg, None)
+            if effect not in Effect.effect_range:
+                raise ValueError('unknown effect: %s' % arg)
+            self.schedule(WattCommand(effect=effect), sent, now)
+        elif address == '/toe':
+            toe = int(arg)
+            if toe < 0 or toe > 127:
+                raise ValueError('toe out of range: %d' % toe)
+            self.schedule(WattCommand(toe=toe), sent, now)
+        elif address == '/stomp':
+            stomp = int(arg)
+            if stomp not in (STOMP_BYPASS, STOMP_ENABLE):
+                raise ValueError('invalid stomp: %d' % stomp)
+            self.schedule(WattCommand(stomp=stomp), sent, now)
+        elif address in ('/tempo', '/program') and self.prog_q is None:
+            raise ValueError('no program is playing: %s' % address)
+        elif address == '/tempo':
+            if arg not in ('+', '-'):
+                arg = int(arg)
+                if arg < MIN_BPM or arg > MAX_BPM:
+                    raise ValueError('tempo out of range: %d' % arg)
+            self.prog_q.put({'bpm': arg})
+        elif address == '/program':
+            if arg not in self.programs:
+                raise ValueError('unknown program: %s' % arg)
+            self.prog_q.put({'program': self.programs[arg]()})
+        else:
+            raise ValueError('unknown address: %s' % address)
+
+    def report(self):
+        """Summary of the messages handled
+        """
+        return '%d messages from %d hosts, %d errors' % (
+            self.received, len(self.clocks), self.errors)
@@ -10,15 +10,19 @@ Testing from the command line:
 from watt import *
 from api import *
 watt = WattOutput(verbose=True)
-watt.write_cmd({'cmd': {'effect': Effect.down2Octaves, 'toe': D_P8},
-                'time': watt.last_timestamp + 10})
+watt.write_cmd(WattCommand(effect=Effect.down2Octaves, toe=D_P8,
+                           time=watt.last_timestamp + 10))
 watt.stop()
 """
 
+from bisect import bisect_left
+from collections import namedtuple
+from itertools import izip
 from optparse import OptionParser
 import pygame
 import pygame.midi
 from Queue import Queue
+import socket
 import string
 import sys
 import termios
@@ -27,6 +31,7 @@ from time import sleep
 import tty
 from api import *  # pylint: disable=unused-wildcard-import,wildcard-import
 from banks import *  # pylint: disable=unused-wildcard-import,wildcard-import
+from server import ControlServer, parse_address
 
 TESTFILE = './watt.out'
 LOOP_BUFFER_SECS = .2
@@ -62,10 +67,29 @@ KEYBOARD_MAP = {
 # Device I/O
 #
 
+class DeviceState(namedtuple('DeviceState',
+                               'stomp effect toe last_timestamp')):
+    """Immutable snapshot of the hardware state.  A new snapshot is published
+    each time the command thread changes the device, so readers on other
+    threads always see the fields of a single consistent state.
+    """
+    __slots__ = ()
+
+    def is_muted(self):
+        """True if the device is enabled and muted with the dive bomb effect
+        """
+        return (self.effect == Effect.diveBomb and
+                self.stomp == STOMP_ENABLE and
+                self.toe == INTERVAL_MAP[Effect.diveBomb][MUTE])
+
 class WattOutput(pygame.midi.Output):
     """Manage the MIDI output.  There are currently some simplifications here
     that assume only one device will be used at a time.
 
+    Device state is owned by a single writer: only write_cmd (called from the
+    command thread) modifies it.  Other threads read the published snapshot
+    in self.state, or the read-only properties derived from it.
+
     """
 
     def __init__(self, verbose=False, latency=2000):
@@ -83,22 +107,58 @@ class WattOutput(pygame.midi.Output):
         else:
             pygame.midi.Output.__init__(self, self.port, latency)
         # Track the state of the hardware, starts in an unknown state
-        self.stomp = None
-        self.effect = None
-        self.toe = None
-        # Keep track of when scheduled commands will finish
-        self.last_timestamp = 0
+        self.state = DeviceState(stomp=None, effect=None, toe=None,
+                                 last_timestamp=0)
+        # Shadow state of the hardware at each scheduled timestamp.  Commands
+        # may be scheduled out of order (live input lands before commands a
+        # program has queued ahead), so dedup decisions are made against the
+        # state at the time a command will play, not the latest state.
+        # Each entry is [timestamp, state, requested, interval]: state is
+        # {field: value} after the commands at timestamp, requested is
+        # {field: written} for the fields commands at timestamp set, and
+        # interval is the interval name the toe was set from (or None) so the
+        # toe can be recomputed if the effect at timestamp changes.
+        self.timeline = [[0, {'stomp': None, 'effect': None, 'toe': None}, {},
+                          None]]
+
+    @property
+    def stomp(self):
+        """Most recently scheduled stomp state"""
+        return self.state.stomp
+
+    @property
+    def effect(self):
+        """Most recently scheduled effect"""
+        return self.state.effect
+
+    @property
+    def toe(self):
+        """Most recently scheduled toe value"""
+        return self.state.toe
+
+    @property
+    def last_timestamp(self):
+        """Time when all scheduled commands will have finished"""
+        return self.state.last_timestamp
+
+    def publish_state(self):
+        """Publish a snapshot of the latest scheduled state for readers
+        """
+        latest = self.timeline[-1][1]
+        self.state = self.state._replace(stomp=latest['stomp'],
+                                         effect=latest['effect'],
+                                         toe=latest['toe'])
 
     def update_last_timestamp(self, timestamp):
         """If this command is later than all scheduled commands, update
         """
-        if timestamp > self.last_timestamp:
-            self.last_timestamp = timestamp
+        if timestamp > self.state.last_timestamp:
+            self.state = self.state._replace(last_timestamp=timestamp)
 
     def wait_last(self):
         """Wait until all scheduled commands have completed
         """
-        while self.last_timestamp > pygame.midi.time():
+        while self.state.last_timestamp > pygame.midi.time():
             sleep(LOOP_SLEEP_SECS)
 
     def stop(self):
@@ -127,65 +187,176 @@ class WattOutput(pygame.midi.Output):
             print '[%s] %s %s\r' % (pygame.midi.time(), byte_array, timestamp)
         self.update_last_timestamp(timestamp)
 
-    def write_cmd(self, command):
-        """Write out a command
+    def timeline_entry(self, timestamp):
+        """Find or insert the shadow state entry for a timestamp.  Returns the
+        index of the entry.
         """
-        cmd = command['cmd']
-        timestamp = command['time']
-        force = True if 'force' in command and command['force'] else False
-        if 'effect' in cmd:
-            if cmd['effect'] != self.effect or force:
-                self.effect = effect = cmd['effect']
-                # Setting the effect also sets the stomp state.  Using patches
-                # 0-15 enables the pedal, using 16-31 maps to the same effects
-                # but bypassed.
-                if 'stomp' in cmd and cmd['stomp'] == STOMP_BYPASS:
-                    effect = effect + 16
-                    # no need for the later stomp command if effect sets it
-                    self.stomp = cmd['stomp']
-
-                self.write_out([0xc0, effect], timestamp)
-        if 'toe' in cmd:
-            if type(cmd['toe']) is str:
-                if cmd['toe'] not in INTERVAL_MAP[self.effect]:
+        # entries that have already played are no longer needed, but always
+        # keep the latest one as the base state
+        played = bisect_left(self.timeline,
+                             [pygame.midi.time() - self.latency]) - 1
+        if played > 0:
+            del self.timeline[:played]
+        idx = bisect_left(self.timeline, [timestamp])
+        if idx < len(self.timeline) and self.timeline[idx][0] == timestamp:
+            return idx
+        # the state at a new timestamp is the state left by the entry before
+        self.timeline.insert(idx, [timestamp,
+                                   dict(self.timeline[max(0, idx - 1)][1]),
+                                   {}, None])
+        return idx
+
+    def schedule(self, idx, changes, byte_array, force):
+        """Apply changes to the shadow state at timeline entry idx, writing
+        out byte_array unless the device will already be in that state.
+        """
+        timestamp, state, requested = self.timeline[idx][:3]
+        written = force or any(state[field] != value
+                               for field, value in changes.iteritems())
+        if written:
+            self.write_out(byte_array, timestamp)
+        # the effect first, so a toe or stomp at the same time follows the patch
+        for field, value in sorted(changes.iteritems()):
+            requested[field] = written or requested.get(field, False)
+            if state[field] != value:
+                state[field] = value
+                self.propagate(idx, field, value)
+                if field == 'effect':
+                    self.resolve_interval(idx)
+
+    def propagate(self, idx, field, value):
+        """A field changed at timeline entry idx.  Later entries that did not
+        set the field inherit the new value.  If the next entry that did set
+        it was skipped as a duplicate of the old value, it is written now.
+        """
+        inherited = []
+        for pos in range(idx + 1, len(self.timeline)):
+            timestamp, state, requested = self.timeline[pos][:3]
+            if field not in requested:
+                state[field] = value
+                inherited.append(pos)
+                continue
+            if not requested[field] and state[field] != value:
+                requested[field] = True
+                if field == 'effect' and 'stomp' in requested:
+                    # the patch sets the stomp state too
+                    requested['stomp'] = True
+                self.write_out(self.field_bytes(field, state), timestamp)
+            break
+        # recompute interval toes once every effect has been written, so a
+        # toe never plays on the previous effect
+        if field == 'effect':
+            for pos in inherited:
+                self.resolve_interval(pos)
+
+    def resolve_interval(self, idx):
+        """The effect at timeline entry idx changed.  If the toe there was set
+        from an interval name, recompute it for the new effect.
+        """
+        timestamp, state, requested, interval = self.timeline[idx]
+        if interval is None or interval not in INTERVAL_MAP.get(
+                state['effect'], {}):
+            return
+        toe = INTERVAL_MAP[state['effect']][interval]
+        if toe != state['toe']:
+            state['toe'] = toe
+            requested['toe'] = True
+            self.write_out(self.field_bytes('toe', state), timestamp)
+            self.propagate(idx, 'toe', toe)
+
+    @staticmethod
+    def field_bytes(field, state):
+        """MIDI bytes that set one field of the device to its value in state
+        """
+        if field == 'effect':
+            # patches 16-31 are the same effects bypassed
+            if state['stomp'] == STOMP_BYPASS:
+                return [0xc0, state['effect'] + 16]
+            return [0xc0, state['effect']]
+        elif field == 'toe':
+            return [0xb0, 11, state['toe']]
+        return [0xb0, 0, state['stomp']]
+
+    def write_cmd(self, command, timestamp=None):
+        """Write out a WattCommand.  Duplicate commands are skipped by
+        comparing against the state of the device at the time the command will
+        play.  timestamp overrides the time of the command, so that one
+        compiled command can be written at many times.
+        """
+        if timestamp is None:
+            timestamp = command.time
+        force = command.force
+        if timestamp is None:
+            # play immediately
+            timestamp = pygame.midi.time() - self.latency
+        idx = self.timeline_entry(timestamp)
+        state = self.timeline[idx][1]
+        if command.toe is not None:
+            # remember the interval so the toe follows later effect changes
+            self.timeline[idx][3] = command.interval
+        if command.effect is not None:
+            effect = command.effect
+            # Setting the effect also sets the stomp state.  Using patches
+            # 0-15 enables the pedal, using 16-31 maps to the same effects
+            # but bypassed.
+            if command.stomp == STOMP_BYPASS:
+                # no need for the later stomp command if effect sets it
+                self.schedule(idx, {'effect': effect, 'stomp': command.stomp},
+                              [0xc0, effect + 16],
+                              force or effect != state['effect'])
+            else:
+                # patches 0-15 switch the pedal on
+                self.schedule(idx, {'effect': effect, 'stomp': STOMP_ENABLE},
+                              [0xc0, effect], force)
+        if command.toe is not None:
+            toe = command.toe
+            if command.interval is not None:
+                if command.interval not in INTERVAL_MAP[state['effect']]:
                     print 'not in interval map\r'
-                    toe = self.toe
+                    toe = state['toe']
                 else:
-                    toe = INTERVAL_MAP[self.effect][cmd['toe']]
-            else:
-                toe = cmd['toe']
-            if toe != self.toe or force:
-                self.write_out([0xb0, 11, toe], timestamp)
-                self.toe = toe
-        if 'stomp' in cmd:
-            if cmd['stomp'] != self.stomp or force:
-                self.stomp = cmd['stomp']
-                self.write_out([0xb0, 0, cmd['stomp']], timestamp)
+                    toe = INTERVAL_MAP[state['effect']][command.interval]
+            self.schedule(idx, {'toe': toe}, [0xb0, 11, toe], force)
+        if command.stomp is not None:
+            self.schedule(idx, {'stomp': command.stomp},
+                          [0xb0, 0, command.stomp], force)
+        self.publish_state()
+        if self.verbose and command.sent is not None:
+            # from sending the command to it playing, which is later than
+            # now if it was scheduled ahead
+            played = max(pygame.midi.time(), timestamp + self.latency)
+            print 'remote command latency %.1fms\r' % (played - command.sent)
 
     @staticmethod
     def beat_to_ts(bpm, beats, measure, beat):
         """Convert a music time notation to a timestamp
         """
-        ms_per_beat = 60 * 1000 / bpm
-        return int((beats * measure + beat) * ms_per_beat)
+        return beat_to_ts(bpm, beats, measure, beat)
 
 #
 # Thread helpers
 #
 
-def write_program(watt, cmd_q, start_time, prog):
-    """Queue a program
+def write_program(watt, cmd_q, start_time, prog, events=None):
+    """Queue one loop of a program.  events are the commands of the program
+    compiled with compile_program, they are compiled here if not given.
+
+    The loop is queued as a single (start_time, events, offsets) tuple that
+    shares the compiled events, rather than a scheduled copy of each event.
     """
+    if events is None:
+        events = compile_program(prog)
     bpm = prog.bpm
     beats = prog.beats
-    cur_bar = -1
-    for command in prog.commands:
-        if watt.verbose:
-            if command['bar'] > cur_bar:
-                print 'start of bar %s\r' % command['bar']
-            cur_bar = command['bar']
-        tstamp = watt.beat_to_ts(bpm, beats, command['bar'], command['beat'])
-        cmd_q.put({'cmd': command, 'time': start_time + tstamp})
+    if watt.verbose:
+        cur_bar = -1
+        for event in events:
+            if event.bar > cur_bar:
+                print 'start of bar %s\r' % event.bar
+            cur_bar = event.bar
+    offsets = [beat_to_ts(bpm, beats, event.bar, event.beat)
+               for event in events]
+    cmd_q.put((start_time, events, offsets))
 
 #
 # Threads
@@ -203,6 +374,9 @@ def program_thread(watt, cmd_q, prog_q, stop_event, prog, count):
     # Need some time to let initialization complete
     consumed_time = pygame.midi.time() + buffer_secs * 1000
 
+    # compile the program once, each loop shares the compiled events
+    events = compile_program(prog)
+
     # count == -1 for infinite play
     while count != 0:
         # sleep when the buffer is full
@@ -218,14 +392,21 @@ def program_thread(watt, cmd_q, prog_q, stop_event, prog, count):
             cmd = prog_q.get()
             if 'bpm' in cmd:
                 if cmd['bpm'] == '+':
-                    prog.bpm = prog.bpm + 10
+                    bpm = prog.bpm + 10
                 elif cmd['bpm'] == '-':
-                    prog.bpm = max(10, prog.bpm - 10)
+                    bpm = prog.bpm - 10
+                else:
+                    bpm = cmd['bpm']
+                prog.bpm = min(MAX_BPM, max(MIN_BPM, bpm))
+            # switch programs at the end of the current loop
+            if 'program' in cmd:
+                prog = cmd['program']
+                events = compile_program(prog)
 
         # note: watt would be more responsive if the entire program was not
         # queued at once, and instead each beat was queued as needed.
-        write_program(watt, cmd_q, consumed_time, prog)
-        consumed_time += watt.beat_to_ts(prog.bpm, prog.beats, prog.measures, 0)
+        write_program(watt, cmd_q, consumed_time, prog, events)
+        consumed_time += beat_to_ts(prog.bpm, prog.beats, prog.measures, 0)
         if count > 0:
             count -= 1
 
@@ -242,16 +423,19 @@ def key_change(key, offset):
         return None
 
 def input_thread(watt, cmd_q, prog_q):
-    """Get characters from stdin, push the resulting commands onto the queue
+    """Get characters from stdin, push the resulting commands onto the queue.
+    prog_q is None when no program is playing.
     """
     offset = 0
     while True:
         key = sys.stdin.read(1)
-        # beats per minute
+        # beats per minute, when a program is playing
         if key in '-_':
-            prog_q.put({'bpm': '-'})
+            if prog_q is not None:
+                prog_q.put({'bpm': '-'})
         elif key in '=+':
-            prog_q.put({'bpm': '+'})
+            if prog_q is not None:
+                prog_q.put({'bpm': '+'})
         # key change
         elif key in '[]12345':
             if key == '[':
@@ -270,20 +454,9 @@ def input_thread(watt, cmd_q, prog_q):
                 keyout = key_change(keyin, offset)
             if keyout is not None:
                 sys.stdout.write(keyin + ' ')
-                cmd = {'toe': keyout}
-                idx = CHROMATIC.index(keyout)
-                if idx > CHROMATIC.index(P1):
-                    cmd['effect'] = Effect.up2Octaves
-                # P1 is accurately played in any of these patches.  By not
-                # reassigning the patch for P1, both ascending and descending
-                # scales can be completed without a patch switch.
-                elif idx < CHROMATIC.index(P1):
-                    if idx >= CHROMATIC.index(D_P15):
-                        cmd['effect'] = Effect.down2Octaves
-                    else:
-                        cmd['effect'] = Effect.diveBomb
-                #cmd_q.put({'cmd': cmd, 'time': watt.last_timestamp + 10})
-                cmd_q.put({'cmd': cmd, 'time': None})
+                cmd = interval_command(keyout, watt.state.effect)
+                #cmd.time = watt.last_timestamp + 10
+                cmd_q.put(cmd)
         elif key == '\r':
             # useful in composition to break up a sequence with a return
             print '\r\n'
@@ -299,58 +472,122 @@ def command_thread(watt, cmd_q, stop_event):
     while True:
         # wait for a command
         command = cmd_q.get()
-        # write out the command
-        watt.write_cmd(command)
+        # write out the command, or each command of a program loop
+        if type(command) is tuple:
+            start_time, events, offsets = command
+            for event, offset in izip(events, offsets):
+                watt.write_cmd(event, start_time + offset)
+        else:
+            watt.write_cmd(command)
         if stop_event.is_set():
             break
 
 def sustain_thread(watt, cmd_q, stop_event, sustain):
+    """Mute the device when no command has been written for sustain seconds
+    """
     while not stop_event.is_set():
-        if watt.last_timestamp + sustain * 1000 < pygame.midi.time() - watt.latency and (
-                watt.effect != Effect.diveBomb or
-                watt.stomp != STOMP_ENABLE or
-                watt.toe != MUTE):
-            cmd_q.put({'cmd': {'effect': Effect.diveBomb,
-                        'stomp': STOMP_ENABLE,
-                        'toe': MUTE},
-                        'time': watt.last_timestamp + sustain * 1000})
+        # read a single snapshot so the fields are consistent with each other
+        state = watt.state
+        if (state.last_timestamp + sustain * 1000 <
+                pygame.midi.time() - watt.latency and not state.is_muted()):
+            cmd_q.put(WattCommand(effect=Effect.diveBomb,
+                                  stomp=STOMP_ENABLE,
+                                  toe=MUTE,
+                                  time=state.last_timestamp + sustain * 1000))
         sleep(sustain / 10)
 
-def run_threads(watt, programs, program, count, sustain):
+def audio_thread(watt, cmd_q, stop_event, source, control):
+    """Track an audio input, push the commands it triggers onto the queue
+    """
+    import audio
+    stats = audio.run_pipeline(source, control, cmd_q.put, stop_event)
+    print 'audio input: %s\r' % stats.report()
+    if stats.overruns and watt.verbose:
+        print 'audio input could not keep up in real time\r'
+
+def server_thread(server, stop_event):
+    """Receive network control messages until stop_event is set
+    """
+    try:
+        server.serve(stop_event)
+    finally:
+        server.close()
+    print 'control server: %s\r' % server.report()
+
+def run_threads(watt, programs, program, count, sustain, audio_path=None,
+                key='C', listen=None):
     """Initialize queue, run threads
     """
     cmd_q = Queue()
     command_stop_event = threading.Event()
-    prog_q = Queue()
+    # tempo and program changes are only read by the program thread
+    if program is not None and audio_path is None:
+        prog_q = Queue()
+    else:
+        prog_q = None
     program_stop_event = threading.Event()
     p_thread = None
+    a_thread = None
+    s_thread = None
+    # build everything that can fail before any thread starts
+    if audio_path is not None:
+        # numpy is only needed for audio input
+        import audio
+        source = audio.WavSource(audio_path, realtime=True)
+        if program is not None:
+            # step through the program on audio onsets
+            control = audio.OnsetStepper(programs[program]())
+        else:
+            # harmonize the audio input
+            control = audio.Harmonizer(
+                key=key, current_effect=lambda: watt.state.effect)
+    if listen is not None:
+        host, port = parse_address(listen)
+        server = ControlServer(cmd_q, prog_q, programs, host, port,
+                               pygame.midi.time, watt.latency,
+                               current_effect=lambda: watt.state.effect)
 
     # command thread
     c_thread = threading.Thread(target=command_thread,
                                 args=(watt, cmd_q, command_stop_event))
     c_thread.start()
 
-    # program thread
+    # program thread, unless the audio input steps through the program
     if program is not None:
-        p_thread = threading.Thread(target=program_thread,
-                                    args=(watt, cmd_q, prog_q,
-                                          program_stop_event,
-                                          programs[program](),
-                                          count))
-        p_thread.start()
+        if audio_path is None:
+            p_thread = threading.Thread(target=program_thread,
+                                        args=(watt, cmd_q, prog_q,
+                                              program_stop_event,
+                                              programs[program](),
+                                              count))
+            p_thread.start()
     else:
         # initialize to upOctave if no program is specified.  This effect works
         # well with live keyboard input
-        cmd_q.put({'cmd': {'effect': Effect.up2Octaves,
-                          'stomp': STOMP_ENABLE,
-                          'toe': P1},
-                   'time': watt.last_timestamp + 10})
+        cmd_q.put(WattCommand(effect=Effect.up2Octaves,
+                              stomp=STOMP_ENABLE,
+                              toe=P1,
+                              time=watt.last_timestamp + 10))
         if sustain != -1:
             p_thread = threading.Thread(target=sustain_thread,
                                         args=(watt, cmd_q, program_stop_event,
                                               sustain))
             p_thread.start()
 
+    # audio input
+    if audio_path is not None:
+        a_thread = threading.Thread(target=audio_thread,
+                                    args=(watt, cmd_q, program_stop_event,
+                                          source, control))
+        a_thread.start()
+
+    # network control
+    if listen is not None:
+        print 'listening for control messages on %s:%s\r' % server.address
+        s_thread = threading.Thread(target=server_thread,
+                                    args=(server, program_stop_event))
+        s_thread.start()
+
     # use the main thread for the input thread
     try:
         input_thread(watt, cmd_q, prog_q)
@@ -364,6 +601,12 @@ def run_threads(watt, programs, program, count, sustain):
             # command will be the last scheduled command
             watt.wait_last()
             p_thread.join()
+        if a_thread is not None:
+            program_stop_event.set()
+            a_thread.join()
+        if s_thread is not None:
+            program_stop_event.set()
+            s_thread.join()
 
         # signal the command thread to stop after the program has completed
         command_stop_event.set()
@@ -372,10 +615,10 @@ def run_threads(watt, programs, program, count, sustain):
         # event because it is waiting on an event.  We need to give it one last
         # command to mute the device anyway, so this also serves the purpose of
         # waking the command thread so that it will detect the stop event.
-        cmd_q.put({'cmd': {'effect': Effect.diveBomb,
-                        'stomp': STOMP_ENABLE,
-                        'toe': MUTE},
-                'time': watt.last_timestamp + 10})
+        cmd_q.put(WattCommand(effect=Effect.diveBomb,
+                              stomp=STOMP_ENABLE,
+                              toe=MUTE,
+                              time=watt.last_timestamp + 10))
 
         c_thread.join()
 
@@ -387,8 +630,15 @@ def main(args):
     """Parse arguments, set up terminal, call main loop
     """
     parser = OptionParser(description=__doc__)
+    parser.add_option("-a", "--audio", default=None,
+                      help="WAV file to use as an audio control source")
     parser.add_option("-c", "--count", default='-1', help="iterations to run")
+    parser.add_option("-k", "--key", default='C',
+                      help="key to harmonize audio input in")
     parser.add_option("-l", "--list", action="store_true", help="list programs")
+    parser.add_option("-n", "--listen", default=None,
+                      help="host:port to receive network control messages on "
+                      "(e.g. 127.0.0.1:9000, or 0.0.0.0:9000 for the LAN)")
     parser.add_option("-p", "--program", default=None, help="specify program")
     parser.add_option("-s", "--sustain", default='-1',
                       help="specify sustain time in seconds (-1 is infinite)")
@@ -410,6 +660,21 @@ def main(args):
         print 'Program %s not found in path' % options.program
         return -1
 
+    try:
+        key_pitch_class(options.key)
+    except ValueError:
+        print 'Unknown key %s, use a note name such as C, F# or Bb' % \
+            options.key
+        return -1
+
+    if options.listen is not None:
+        try:
+            parse_address(options.listen)
+        except ValueError:
+            print 'Invalid address %s, use host:port such as 127.0.0.1:9000' % \
+                options.listen
+            return -1
+
     watt = WattOutput(verbose=options.verbose)
 
     # Set the terminal to unbuffered, to catch a single keypress
@@ -421,10 +686,15 @@ def main(args):
 
         # main thread execution
         run_threads(watt, programs, options.program, int(options.count),
-                    float(options.sustain))
+                    float(options.sustain), options.audio, options.key,
+                    options.listen)
     except (KeyboardInterrupt, SystemExit):
         # return term to normal state before exception is displayed
         termios.tcsetattr(infd, termios.TCSADRAIN, old_settings)
+    except socket.error as err:
+        termios.tcsetattr(infd, termios.TCSADRAIN, old_settings)
+        print 'Cannot listen on %s: %s' % (options.listen, err)
+        return -1
     finally:
         if watt:
             watt.stop()